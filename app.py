@@ -1,10 +1,25 @@
+import cProfile
+import io
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from azure.identity import ManagedIdentityCredential
-from azure.storage.blob import BlobServiceClient
-from azure.storage.fileshare import ShareClient
+import pstats
+import threading
+import time
+from flask import Flask, Response, abort, g, jsonify, render_template, stream_template, request, redirect, url_for, flash, session
+from flask import before_render_template, template_rendered
+from werkzeug.http import is_resource_modified, unquote_etag
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
 import msal
 
+from bulk_upload import bulk_upload
+from blob_listing import ListingCache, list_blob_page
+from clients import ClientRegistry, UserTokenCredential
+from fileshare_index import FileShareIndex
+from local_storage import LocalStorage, mbps_to_bytes
+from metrics import metrics
+from sessions import FileSystemSessionStore, MemorySessionStore, ServerSideSessionInterface
+from streaming_upload import MissingFileError, stream_upload
+
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'  # Ensure SECRET_KEY is set in your environment
 
@@ -12,6 +27,8 @@ app.secret_key = 'supersecretkey'  # Ensure SECRET_KEY is set in your environmen
 STORAGE_ACCOUNT_NAME = os.getenv('AZURE_STORAGE_ACCOUNT_NAME')
 BLOB_CONTAINER_NAME = os.getenv('AZURE_STORAGE_CONTAINER_NAME')
 SHARE_NAME = os.getenv('AZURE_FILE_SHARE_NAME')
+BLOB_ACCOUNT_URL = f"https://{STORAGE_ACCOUNT_NAME}.blob.core.windows.net"
+FILE_ACCOUNT_URL = f"https://{STORAGE_ACCOUNT_NAME}.file.core.windows.net"
 
 # Azure AD Config
 CLIENT_ID = os.getenv('AZURE_CLIENT_ID')
@@ -20,32 +37,208 @@ TENANT_ID = os.getenv('AZURE_TENANT_ID')
 AUTHORITY = f"https://login.microsoftonline.com/{TENANT_ID}"
 REDIRECT_PATH = "/getAToken"
 SCOPE = ["https://storage.azure.com/user_impersonation"]
-SESSION_TYPE = "filesystem"
 
-# MSAL setup
-msal_client = msal.ConfidentialClientApplication(
-    CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
-)
+# Sessions: "filesystem" and "memory" keep the data server-side and only put an
+# opaque id in the cookie, "cookie" is Flask's signed cookie session
+SESSION_TYPE = os.getenv('SESSION_TYPE', 'filesystem')
+SESSION_FILE_DIR = os.getenv('SESSION_FILE_DIR', 'flask_session')
+SESSION_MEMORY_SIZE = int(os.getenv('SESSION_MEMORY_SIZE', 10000))
 
-# Use Managed Identity to authenticate with Azure Storage
-credential = ManagedIdentityCredential()
+if SESSION_TYPE == 'filesystem':
+    app.session_interface = ServerSideSessionInterface(FileSystemSessionStore(SESSION_FILE_DIR))
+elif SESSION_TYPE == 'memory':
+    app.session_interface = ServerSideSessionInterface(MemorySessionStore(SESSION_MEMORY_SIZE))
 
-# Blob Storage client
-blob_service_client = BlobServiceClient(
-    f"https://{STORAGE_ACCOUNT_NAME}.blob.core.windows.net", credential=credential
-)
+# Profiling: with PROFILING_ENABLED=1, requests sent with an "X-Profile: 1" header
+# are run under cProfile and logged when slower than PROFILE_SLOW_SECONDS
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED') == '1'
+PROFILE_SLOW_SECONDS = float(os.getenv('PROFILE_SLOW_SECONDS', 0.5))
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', 30))
+
+# Only one profiler can be active per process (3.12 raises on a second
+# enable() and profiles every thread), so X-Profile requests that arrive
+# while another is being profiled go unprofiled
+profile_lock = threading.Lock()
+
+# "user" makes blob calls with the signed-in user's token instead of the managed
+# identity (WSGI only, the ASGI app in asgi.py refuses to start with it)
+STORAGE_AUTH = os.getenv('STORAGE_AUTH', 'managed_identity')
+
+# Upload tuning: "buffered" hands the spooled file to upload_blob(), "streaming"
+# reads the request body incrementally and stages blocks in parallel
+UPLOAD_MODE = os.getenv('UPLOAD_MODE', 'buffered')
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 4))
+
+# Bulk uploads: files uploading in parallel, and the size up to which each
+# buffered file (or zip archive) stays in memory before spilling to disk
+BULK_UPLOAD_CONCURRENCY = int(os.getenv('BULK_UPLOAD_CONCURRENCY', 16))
+BULK_UPLOAD_SPOOL_SIZE = int(os.getenv('BULK_UPLOAD_SPOOL_SIZE', 8 * 1024 * 1024))
+
+# Downloads are streamed in chunks of this size, which bounds per-request memory
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+
+# Blob listing: page size and in-process page cache
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', 500))
+LIST_CACHE_TTL = float(os.getenv('LIST_CACHE_TTL', 30))
+LIST_CACHE_SIZE = int(os.getenv('LIST_CACHE_SIZE', 256))
+
+listing_cache = ListingCache(maxsize=LIST_CACHE_SIZE, ttl=LIST_CACHE_TTL)
+
+# Azure File Share index: /fileshare is served from a local SQLite copy that
+# is re-crawled in the background once it is older than the interval
+FILESHARE_INDEX_PATH = os.getenv('FILESHARE_INDEX_PATH', 'fileshare_index.sqlite3')
+FILESHARE_CRAWL_INTERVAL = float(os.getenv('FILESHARE_CRAWL_INTERVAL', 300))
+FILESHARE_CRAWL_CONCURRENCY = int(os.getenv('FILESHARE_CRAWL_CONCURRENCY', 8))
+# Workers share the index, and a crawl holds a lease in it so only one of
+# them crawls at a time; the lease outlives a worker that dies mid-crawl
+FILESHARE_CRAWL_LEASE = float(os.getenv('FILESHARE_CRAWL_LEASE', 900))
+
+fileshare_index = FileShareIndex(FILESHARE_INDEX_PATH, lease_seconds=FILESHARE_CRAWL_LEASE)
+
+# MSAL, Managed Identity, Blob Storage and File Share clients are built on
+# first use; STORAGE_POOL_SIZE is the keep-alive pool shared by the storage clients
+STORAGE_POOL_SIZE = int(os.getenv('STORAGE_POOL_SIZE', 32))
+
+# STORAGE_BACKEND=local swaps Blob Storage and the File Share for a directory
+# on this host, with simulated per-call latency and bandwidth in Mbit/s (0 = unlimited)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'azure')
+LOCAL_STORAGE_ROOT = os.getenv('LOCAL_STORAGE_ROOT', 'local_storage')
+LOCAL_STORAGE_LATENCY_MS = float(os.getenv('LOCAL_STORAGE_LATENCY_MS', 0))
+LOCAL_STORAGE_BANDWIDTH_MBPS = float(os.getenv('LOCAL_STORAGE_BANDWIDTH_MBPS', 0))
+
+local_storage = None
+if STORAGE_BACKEND == 'local':
+    local_storage = LocalStorage(
+        LOCAL_STORAGE_ROOT, latency=LOCAL_STORAGE_LATENCY_MS / 1000,
+        bandwidth=mbps_to_bytes(LOCAL_STORAGE_BANDWIDTH_MBPS), download_chunk_size=DOWNLOAD_CHUNK_SIZE
+    )
 
-# Azure File Share client
-share_client = ShareClient(
-    f"https://{STORAGE_ACCOUNT_NAME}.file.core.windows.net/{SHARE_NAME}", credential=credential
+clients = ClientRegistry(
+    BLOB_ACCOUNT_URL, FILE_ACCOUNT_URL, SHARE_NAME, CLIENT_ID, CLIENT_SECRET, AUTHORITY,
+    pool_size=STORAGE_POOL_SIZE, download_chunk_size=DOWNLOAD_CHUNK_SIZE, local_storage=local_storage
 )
 
+def blob_service_client():
+    if STORAGE_AUTH != 'user' or not session.get('user'):
+        return clients.blob_service_client
+    if 'user_blob_service_client' not in g:
+        g.token_cache = load_token_cache()
+        msal_app = clients.msal_app(g.token_cache)
+        credential = UserTokenCredential(msal_app, session_account(msal_app))
+        g.user_blob_service_client = clients.user_blob_service_client(credential)
+    return g.user_blob_service_client
+
+def session_account(msal_app):
+    # The cache account of the signed-in user, never just whichever account comes first
+    claims = session['user']
+    home_account_id = f"{claims.get('oid')}.{claims.get('tid')}"
+    for account in msal_app.get_accounts():
+        if account.get('home_account_id') == home_account_id:
+            return account
+    return None
+
+def load_token_cache():
+    cache = msal.SerializableTokenCache()
+    if session.get('token_cache'):
+        cache.deserialize(session['token_cache'])
+    return cache
+
+def save_token_cache(cache):
+    if cache.has_state_changed:
+        session['token_cache'] = cache.serialize()
+
+@app.after_request
+def persist_token_cache(response):
+    # Refreshed tokens from acquire_token_silent go back into the session
+    if 'token_cache' in g:
+        save_token_cache(g.token_cache)
+    return response
+
+class RequestProfile:
+    """cProfile run for one request, stopped exactly once by whichever of finish() or teardown comes first."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.stopped = False
+
+    def stop(self):
+        if self.stopped:
+            return False
+        self.stopped = True
+        self.profiler.disable()
+        profile_lock.release()
+        return True
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILING_ENABLED and request.headers.get('X-Profile') == '1' and profile_lock.acquire(blocking=False):
+        profile = RequestProfile()
+        try:
+            profile.profiler.enable()
+        except ValueError:
+            # Another profiling tool (not ours) is active
+            profile_lock.release()
+            app.logger.warning('Profiling skipped, another profiler is active')
+            return
+        g.profile = profile
+
+@app.after_request
+def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, path, status = request.method, request.path, str(response.status_code)
+    # Stays in g as well, in case this response is discarded by a later hook
+    profile = g.get('profile')
+
+    # Runs once the body has been sent, so streamed responses are timed in full
+    def finish():
+        elapsed = time.perf_counter() - started
+        metrics.observe('http_request_seconds', elapsed, route=route, method=method, status=status)
+        if profile is not None and profile.stop() and elapsed >= PROFILE_SLOW_SECONDS:
+            summary = io.StringIO()
+            pstats.Stats(profile.profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP)
+            app.logger.warning('Slow request %s %s took %.3fs\n%s', method, path, elapsed, summary.getvalue())
+
+    response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def stop_abandoned_profiler(exc):
+    # Teardown runs before the body is sent, so a successful request is left
+    # to finish(); after an error (e.g. save_session raising once
+    # record_request ran) its response may never be closed
+    profile = g.get('profile')
+    if profile is not None and exc is not None:
+        profile.stop()
+
+def start_template_timer(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+def record_template(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        metrics.observe('template_render_seconds', time.perf_counter() - started, template=template.name)
+
+before_render_template.connect(start_template_timer, app)
+template_rendered.connect(record_template, app)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/')
 def index():
     return render_template('upload.html')
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    if UPLOAD_MODE == 'streaming':
+        return upload_file_streaming()
+
     if 'file' not in request.files:
         flash('No file part')
         return redirect(request.url)
@@ -57,39 +250,201 @@ def upload_file():
 
     # Upload to Azure Blob Storage
     try:
-        blob_client = blob_service_client.get_blob_client(container=BLOB_CONTAINER_NAME, blob=file.filename)
+        blob_client = blob_service_client().get_blob_client(container=BLOB_CONTAINER_NAME, blob=file.filename)
         blob_client.upload_blob(file)
+        metrics.inc('upload_bytes_total', file.stream.tell(), mode='buffered')
+        listing_cache.invalidate(file.filename)
         flash(f"File {file.filename} uploaded to Blob Storage!")
         return redirect(url_for('index'))
     except Exception as e:
         flash(f"Failed to upload to Blob Storage: {e}")
         return redirect(request.url)
 
+def upload_file_streaming():
+    # Must not touch request.files/request.form here, that would spool the body
+    def get_blob_client(filename):
+        return blob_service_client().get_blob_client(container=BLOB_CONTAINER_NAME, blob=filename)
+
+    try:
+        filename, size = stream_upload(
+            request.stream, request.content_type, get_blob_client,
+            chunk_size=UPLOAD_CHUNK_SIZE, concurrency=UPLOAD_CONCURRENCY
+        )
+        metrics.inc('upload_bytes_total', size, mode='streaming')
+        listing_cache.invalidate(filename)
+        flash(f"File {filename} uploaded to Blob Storage!")
+        return redirect(url_for('index'))
+    except MissingFileError as e:
+        flash(str(e))
+        return redirect(request.url)
+    except Exception as e:
+        flash(f"Failed to upload to Blob Storage: {e}")
+        return redirect(request.url)
+
+@app.route('/upload/bulk', methods=['POST'])
+def bulk_upload_files():
+    # Many files, or zip/tar archives (expanded unless ?expand=0), in one request
+    def get_blob_client(name):
+        return blob_service_client().get_blob_client(container=BLOB_CONTAINER_NAME, blob=name)
+
+    try:
+        results = bulk_upload(
+            request.stream, request.content_type, get_blob_client,
+            concurrency=BULK_UPLOAD_CONCURRENCY, spool_size=BULK_UPLOAD_SPOOL_SIZE,
+            expand=request.args.get('expand', '1') != '0', overwrite=request.args.get('overwrite') == '1',
+            prefix=request.args.get('prefix', '')
+        )
+    except MissingFileError as e:
+        return jsonify(error=str(e)), 400
+    except Exception as e:
+        return jsonify(error=f"Failed to upload to Blob Storage: {e}"), 500
+
+    counts = {'uploaded': 0, 'skipped': 0, 'error': 0}
+    for result in results:
+        counts[result['status']] += 1
+        if result['status'] == 'uploaded':
+            listing_cache.invalidate(result['name'])
+            metrics.inc('upload_bytes_total', result['size'], mode='bulk')
+    return jsonify(results=results, uploaded=counts['uploaded'], skipped=counts['skipped'], failed=counts['error'])
+
 @app.route('/list')
 def list_files():
+    prefix = request.args.get('prefix', '')
+    delimiter = request.args.get('delimiter', '')
+    marker = request.args.get('marker') or None
     try:
-        # List files in Azure Blob Storage container
-        container_client = blob_service_client.get_container_client(BLOB_CONTAINER_NAME)
-        blobs = container_client.list_blobs()
-        blob_names = [blob.name for blob in blobs]
-        return render_template('list.html', blobs=blob_names)
+        # List one page of the Azure Blob Storage container, served from cache when fresh
+        container_client = blob_service_client().get_container_client(BLOB_CONTAINER_NAME)
+        scope = session['user'].get('oid') if STORAGE_AUTH == 'user' and session.get('user') else None
+        page = list_blob_page(container_client, listing_cache, prefix, delimiter, marker, LIST_PAGE_SIZE, scope)
     except Exception as e:
         return f"Error listing files: {e}"
+    # The page is fetched while the template streams, so the head goes out first
+    return stream_template('list.html', blobs=page, page=page, prefix=prefix, delimiter=delimiter)
+
+@app.route('/download/<path:name>')
+def download_file(name):
+    blob_client = blob_service_client().get_blob_client(container=BLOB_CONTAINER_NAME, blob=name)
+    try:
+        props = blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        abort(404)
+    except Exception as e:
+        return f"Error downloading file: {e}", 502
+
+    response, download_kwargs = prepare_download(name, props)
+    if download_kwargs is not None:
+        response.response = _iter_download(blob_client, download_kwargs)
+    return response
+
+def _iter_download(blob_client, download_kwargs):
+    for chunk in blob_client.download_blob(**download_kwargs).chunks():
+        metrics.inc('download_bytes_total', len(chunk))
+        yield chunk
+
+def prepare_download(name, props):
+    # Returns the response (headers only) and the download_blob() arguments
+    # for its body, or None when there is no body to send
+    etag, _ = unquote_etag(props.etag)
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'private, no-cache'}
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=props.last_modified):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        response.last_modified = props.last_modified
+        return response, None
+
+    offset, length, status = None, props.size, 200
+    # Multiple ranges and units other than bytes are ignored, which means a full 200
+    byte_range = request.range
+    if (byte_range is not None and byte_range.units == 'bytes' and len(byte_range.ranges) == 1
+            and _range_applies(etag, props.last_modified)):
+        span = byte_range.range_for_length(props.size)
+        if span is None:
+            headers['Content-Range'] = f"bytes */{props.size}"
+            return Response(status=416, headers=headers), None
+        offset, length, status = span[0], span[1] - span[0], 206
+        headers['Content-Range'] = f"bytes {span[0]}-{span[1] - 1}/{props.size}"
+
+    response = Response(
+        status=status, headers=headers,
+        content_type=props.content_settings.content_type or 'application/octet-stream'
+    )
+    response.content_length = length
+    response.set_etag(etag)
+    response.last_modified = props.last_modified
+    response.headers.set('Content-Disposition', 'attachment', filename=os.path.basename(name))
+    if length == 0:
+        return response, None
+    # Pin the download to the etag we answered with, so a concurrent
+    # overwrite cannot splice two versions into one response
+    download_kwargs = {
+        'offset': offset,
+        'length': length if offset is not None else None,
+        'etag': props.etag,
+        'match_condition': MatchConditions.IfNotModified,
+    }
+    return response, download_kwargs
+
+def _range_applies(etag, last_modified):
+    # If-Range: only honour the Range header when the client's copy is current
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return last_modified <= if_range.date
+    return True
 
 @app.route('/fileshare')
 def file_share():
     try:
-        # List files in Azure Files Share
-        files = share_client.list_directories_and_files()
-        file_names = [file.name for file in files]
-        return render_template('list.html', blobs=file_names)
+        last_crawl = fileshare_index.last_crawl()
+        if last_crawl is None:
+            # Nothing indexed yet, so this request has to wait for the share,
+            # or for the crawl another request or worker already started
+            if fileshare_index.crawl(clients.share_client, FILESHARE_CRAWL_CONCURRENCY) is None:
+                fileshare_index.wait_for_crawl()
+            last_crawl = fileshare_index.last_crawl()
+        elif time.time() - last_crawl > FILESHARE_CRAWL_INTERVAL or request.args.get('refresh'):
+            refresh_fileshare_index()
+        return render_template('fileshare.html', **fileshare_context(last_crawl))
     except Exception as e:
         return f"Error accessing Azure Files: {e}"
 
+def fileshare_context(last_crawl):
+    # Browse (?path=) or search (?q=, min_size, max_size) the local index
+    path = request.args.get('path', '').strip('/')
+    query = request.args.get('q', '')
+    min_size = request.args.get('min_size', type=int)
+    max_size = request.args.get('max_size', type=int)
+    searching = bool(query) or min_size is not None or max_size is not None
+    if searching:
+        files = fileshare_index.search(query, min_size, max_size)
+    else:
+        files = fileshare_index.browse(path)
+    return dict(
+        files=files, path=path, searching=searching, query=query, min_size=min_size,
+        max_size=max_size, crawling=fileshare_index.crawling,
+        last_crawl=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_crawl)) if last_crawl else None
+    )
+
+def refresh_fileshare_index():
+    if fileshare_index.crawling:
+        return
+
+    def crawl():
+        try:
+            fileshare_index.crawl(clients.share_client, FILESHARE_CRAWL_CONCURRENCY)
+        except Exception:
+            app.logger.exception('Azure Files crawl failed')
+
+    threading.Thread(target=crawl, name='fileshare-crawl', daemon=True).start()
+
 @app.route("/login")
 def login():
     # Redirect to Azure AD for authentication
-    auth_url = msal_client.get_authorization_request_url(SCOPE, redirect_uri=url_for("auth_response", _external=True))
+    with metrics.span('msal', 'get_authorization_request_url'):
+        auth_url = clients.msal_client.get_authorization_request_url(SCOPE, redirect_uri=url_for("auth_response", _external=True))
     return redirect(auth_url)
 
 @app.route(REDIRECT_PATH)
@@ -97,9 +452,19 @@ def auth_response():
     # Handle the redirect from Azure AD and acquire a token
     code = request.args.get('code')
     if code:
-        token = msal_client.acquire_token_by_authorization_code(code, scopes=SCOPE, redirect_uri=url_for("auth_response", _external=True))
+        # Start from an empty cache, never from tokens left in the session by an earlier user
+        cache = msal.SerializableTokenCache()
+        msal_app = clients.msal_app(cache)
+        with metrics.span('msal', 'acquire_token_by_authorization_code'):
+            token = msal_app.acquire_token_by_authorization_code(code, scopes=SCOPE, redirect_uri=url_for("auth_response", _external=True))
         if 'access_token' in token:
-            session['user'] = token
+            session.pop('user', None)
+            session.pop('token_cache', None)
+            if isinstance(app.session_interface, ServerSideSessionInterface):
+                app.session_interface.regenerate(session)
+            # Only the claims go in the session; tokens stay in the user's MSAL cache
+            session['user'] = token.get('id_token_claims')
+            save_token_cache(cache)
             return redirect(url_for('index'))
         else:
             return "Login failed"
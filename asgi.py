@@ -0,0 +1,286 @@
+"""ASGI entry point with async variants of the storage routes.
+
+    uvicorn asgi:application --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+
+/upload, /list, /fileshare and /download/<name> are served by coroutines
+using the azure aio clients, which share one aiohttp connection pool per
+process. Every other route (login, logout, the upload form) falls through
+to the Flask app. Uploads are always streamed in this mode.
+
+Storage is always accessed as the managed identity here, so the app refuses
+to start with STORAGE_AUTH=user; serve app:app under gunicorn for that.
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+
+import aiohttp
+from asgiref.wsgi import WsgiToAsgi
+from azure.core.exceptions import ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity.aio import ManagedIdentityCredential
+from azure.storage.blob.aio import BlobServiceClient
+from azure.storage.fileshare.aio import ShareClient
+from flask import abort, flash, redirect, render_template, request, url_for
+from werkzeug.exceptions import HTTPException, MethodNotAllowed, NotFound
+from werkzeug.routing import Map, Rule
+
+from app import (
+    BLOB_ACCOUNT_URL, BLOB_CONTAINER_NAME, DOWNLOAD_CHUNK_SIZE, FILE_ACCOUNT_URL,
+    FILESHARE_CRAWL_CONCURRENCY, FILESHARE_CRAWL_INTERVAL, LIST_PAGE_SIZE, SHARE_NAME, STORAGE_AUTH,
+    UPLOAD_CHUNK_SIZE, UPLOAD_CONCURRENCY, app, fileshare_context, fileshare_index,
+    listing_cache, prepare_download
+)
+from blob_listing import list_blob_page_async
+from metrics import StorageMetricsPolicy, metrics
+from streaming_upload import MissingFileError, async_stream_upload
+
+# Connections kept open per process, shared by the blob and share clients
+ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', 100))
+
+url_map = Map([
+    Rule('/upload', endpoint='upload_file', methods=['POST']),
+    Rule('/list', endpoint='list_files'),
+    Rule('/fileshare', endpoint='file_share'),
+    Rule('/download/<path:name>', endpoint='download_file'),
+])
+
+
+class AsyncClients:
+    """Per-process aio clients, created on first use inside the server's event loop."""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self.session = None
+        self.credential = None
+        self.blob_service_client = None
+        self.share_client = None
+
+    async def open(self):
+        async with self._lock:
+            if self.session is not None:
+                return self
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=ASYNC_POOL_SIZE, keepalive_timeout=60)
+            )
+            self.credential = ManagedIdentityCredential()
+            self.blob_service_client = BlobServiceClient(
+                BLOB_ACCOUNT_URL, credential=self.credential,
+                transport=AioHttpTransport(session=self.session, session_owner=False),
+                per_call_policies=[StorageMetricsPolicy(metrics, 'blob')],
+                max_single_get_size=DOWNLOAD_CHUNK_SIZE, max_chunk_get_size=DOWNLOAD_CHUNK_SIZE
+            )
+            self.share_client = ShareClient(
+                FILE_ACCOUNT_URL, share_name=SHARE_NAME, credential=self.credential, token_intent='backup',
+                transport=AioHttpTransport(session=self.session, session_owner=False),
+                per_call_policies=[StorageMetricsPolicy(metrics, 'file')]
+            )
+            return self
+
+    async def close(self):
+        async with self._lock:
+            if self.session is None:
+                return
+            await self.blob_service_client.close()
+            await self.share_client.close()
+            await self.credential.close()
+            await self.session.close()
+            self.session = None
+
+
+class AsyncStorageApp:
+    def __init__(self, flask_app):
+        if STORAGE_AUTH == 'user':
+            # The aio clients have no per-user credential, so serving would
+            # silently use the app's identity for every user
+            raise RuntimeError('STORAGE_AUTH=user is not supported by the ASGI app, serve app:app instead')
+        self.flask_app = flask_app
+        self.fallback = WsgiToAsgi(flask_app)
+        self.clients = AsyncClients()
+        self._crawl_task = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return await self.fallback(scope, receive, send)
+
+        adapter = url_map.bind('localhost', script_name=scope.get('root_path') or None)
+        try:
+            rule, args = adapter.match(scope['path'], method=scope['method'], return_rule=True)
+        except (NotFound, MethodNotAllowed):
+            return await self.fallback(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 'error'
+        with self.flask_app.request_context(_environ(scope)):
+            try:
+                rv, body = await getattr(self, rule.endpoint)(receive, **args)
+            except HTTPException as e:
+                rv, body = e, None
+            response = self.flask_app.process_response(self.flask_app.make_response(rv))
+            status = str(response.status_code)
+            await send({
+                'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()],
+            })
+            if scope['method'] == 'HEAD':
+                body = None
+            elif body is None:
+                body = _aiter([response.get_data()])
+            if body is not None:
+                async for chunk in body:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        metrics.observe(
+            'http_request_seconds', time.perf_counter() - started,
+            route=rule.rule, method=scope['method'], status=status
+        )
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.clients.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def upload_file(self, receive):
+        clients = await self.clients.open()
+
+        def get_blob_client(filename):
+            return clients.blob_service_client.get_blob_client(container=BLOB_CONTAINER_NAME, blob=filename)
+
+        try:
+            filename, size = await async_stream_upload(
+                _body_chunks(receive), request.content_type, get_blob_client,
+                chunk_size=UPLOAD_CHUNK_SIZE, concurrency=UPLOAD_CONCURRENCY
+            )
+            metrics.inc('upload_bytes_total', size, mode='async')
+            listing_cache.invalidate(filename)
+            flash(f"File {filename} uploaded to Blob Storage!")
+            return redirect(url_for('index')), None
+        except MissingFileError as e:
+            flash(str(e))
+            return redirect(request.url), None
+        except Exception as e:
+            flash(f"Failed to upload to Blob Storage: {e}")
+            return redirect(request.url), None
+
+    async def list_files(self, receive):
+        prefix = request.args.get('prefix', '')
+        delimiter = request.args.get('delimiter', '')
+        marker = request.args.get('marker') or None
+        try:
+            clients = await self.clients.open()
+            container_client = clients.blob_service_client.get_container_client(BLOB_CONTAINER_NAME)
+            page = await list_blob_page_async(container_client, listing_cache, prefix, delimiter, marker, LIST_PAGE_SIZE)
+        except Exception as e:
+            return f"Error listing files: {e}", None
+        return render_template('list.html', blobs=page, page=page, prefix=prefix, delimiter=delimiter), None
+
+    async def file_share(self, receive):
+        try:
+            last_crawl = await asyncio.to_thread(fileshare_index.last_crawl)
+            if last_crawl is None:
+                # Nothing indexed yet, so this request has to wait for the share,
+                # or for the crawl another request or worker already started
+                if await self._crawl() is None:
+                    await asyncio.to_thread(fileshare_index.wait_for_crawl)
+                last_crawl = await asyncio.to_thread(fileshare_index.last_crawl)
+            elif time.time() - last_crawl > FILESHARE_CRAWL_INTERVAL or request.args.get('refresh'):
+                if self._crawl_task is None or self._crawl_task.done():
+                    self._crawl_task = asyncio.create_task(self._crawl())
+            context = await asyncio.to_thread(fileshare_context, last_crawl)
+            return render_template('fileshare.html', **context), None
+        except Exception as e:
+            return f"Error accessing Azure Files: {e}", None
+
+    async def _crawl(self):
+        clients = await self.clients.open()
+        try:
+            return await fileshare_index.crawl_async(clients.share_client, FILESHARE_CRAWL_CONCURRENCY)
+        except Exception:
+            app.logger.exception('Azure Files crawl failed')
+            raise
+
+    async def download_file(self, receive, name):
+        clients = await self.clients.open()
+        blob_client = clients.blob_service_client.get_blob_client(container=BLOB_CONTAINER_NAME, blob=name)
+        try:
+            props = await blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            abort(404)
+        except Exception as e:
+            return (f"Error downloading file: {e}", 502), None
+
+        response, download_kwargs = prepare_download(name, props)
+        if download_kwargs is None:
+            return response, None
+        return response, _aiter_download(blob_client, download_kwargs)
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+async def _aiter_download(blob_client, download_kwargs):
+    downloader = await blob_client.download_blob(**download_kwargs)
+    async for chunk in downloader.chunks():
+        metrics.inc('download_bytes_total', len(chunk))
+        yield chunk
+
+
+async def _body_chunks(receive):
+    # Request body as an async iterator, ending with b'' to mark EOF
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError('Client disconnected during upload')
+        if message.get('body'):
+            yield message['body']
+        if not message.get('more_body'):
+            yield b''
+            return
+
+
+def _environ(scope):
+    # Just enough WSGI environ for Flask's request context (args, headers, cookies, url_for)
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+application = AsyncStorageApp(app)
@@ -0,0 +1,170 @@
+"""Drive one or more running deployments with concurrent clients and compare them.
+
+Start the sync and async deployments with the same memory budget, e.g.
+
+    gunicorn -w 8 -b 127.0.0.1:8000 app:app
+    gunicorn -w 2 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8001 asgi:application
+
+then run
+
+    python benchmarks/loadtest.py --path /list --concurrency 64 \\
+        sync=http://127.0.0.1:8000 async=http://127.0.0.1:8001 \\
+        --pid sync=<gunicorn master pid> --pid async=<gunicorn master pid>
+
+and compare requests/sec and p99 latency; with --pid the peak RSS of each
+server's process tree is reported too, so the memory budgets can be matched.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import requests
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def tree_rss(pid):
+    """Resident set size in bytes of pid and all its descendants (Linux only)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, tree_rss(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def run_load(make_request, concurrency, duration=None, requests_per_client=None, pid=None):
+    """Call make_request(session) from ``concurrency`` threads and summarise the latencies.
+
+    make_request returns the number of bytes transferred. Runs for ``duration``
+    seconds, or ``requests_per_client`` calls per thread if given.
+    """
+    latencies = []
+    errors = []
+    transferred = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + (duration or 0)
+
+    def client():
+        session = requests.Session()
+        local_latencies, local_errors, local_bytes = [], 0, 0
+        count = 0
+        while True:
+            if requests_per_client is not None:
+                if count >= requests_per_client:
+                    break
+            elif time.perf_counter() >= deadline:
+                break
+            count += 1
+            start = time.perf_counter()
+            try:
+                local_bytes += make_request(session)
+                local_latencies.append(time.perf_counter() - start)
+            except Exception:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+            transferred.append(local_bytes)
+
+    sampler = RssSampler(pid) if pid else None
+    if sampler:
+        sampler.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'mb_per_sec': round(sum(transferred) / elapsed / (1024 * 1024), 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'peak_rss_mb': round(sampler.stop() / (1024 * 1024), 1) if sampler else None,
+    }
+
+
+def print_table(rows):
+    print(f"{'target':<16}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'RSS MB':>9}")
+    for name, result in rows:
+        rss = '-' if result['peak_rss_mb'] is None else result['peak_rss_mb']
+        print(
+            f"{name:<16}{result['requests_per_sec']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+            f"{result['p99_ms']:>10}{result['errors']:>8}{rss:>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('targets', nargs='+', metavar='NAME=URL')
+    parser.add_argument('--path', default='/list')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--pid', action='append', default=[], metavar='NAME=PID')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    pids = dict(item.split('=', 1) for item in args.pid)
+    rows = []
+    for target in args.targets:
+        name, url = target.split('=', 1)
+
+        def make_request(session, url=url):
+            response = session.get(url.rstrip('/') + args.path)
+            response.raise_for_status()
+            return len(response.content)
+
+        pid = int(pids[name]) if name in pids else None
+        rows.append((name, run_load(make_request, args.concurrency, args.duration, pid=pid)))
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({name: result for name, result in rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Reproducible load benchmark of every route against the local storage stand-in.
+
+Seeds a throwaway LOCAL_STORAGE_ROOT with a fixed data set, starts the app
+under gunicorn with STORAGE_BACKEND=local and simulated storage latency and
+bandwidth, then drives each scenario with concurrent clients and reports
+requests/sec, p50/p95/p99 latency and the peak RSS of the gunicorn process
+tree. Results are written as JSON so two versions can be compared:
+
+    python benchmarks/suite.py --output before.json
+    git checkout my-branch
+    python benchmarks/suite.py --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import run_load  # noqa: E402
+from local_storage import LocalStorage  # noqa: E402
+
+CONTAINER = 'bench'
+METRICS = ('requests_per_sec', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb', 'errors')
+
+
+def seed(root, blobs, large_mb, share_dirs, share_files):
+    """Fill root with ``blobs`` small blobs, one large blob and a share tree; all contents are deterministic."""
+    service = LocalStorage(root).blob_service_client()
+    for i in range(blobs):
+        folder = f'folder-{i % 10}/' if i % 2 else ''
+        data = (f'{i:08d}' * 128).encode()
+        service.get_blob_client(CONTAINER, f'{folder}file-{i:05d}.txt').upload_blob(data)
+    block = bytes(range(256)) * 4096
+    service.get_blob_client(CONTAINER, 'large.bin').upload_blob(
+        io.BytesIO(block * (large_mb * 1024 * 1024 // len(block)))
+    )
+
+    share = os.path.join(root, 'share')
+    for d in range(share_dirs):
+        directory = os.path.join(share, f'dir-{d:03d}', 'nested')
+        os.makedirs(directory, exist_ok=True)
+        for f in range(share_files):
+            with open(os.path.join(directory, f'report-{f:04d}.csv'), 'wb') as out:
+                out.write(b'x' * (f * 100))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir, port):
+    env = dict(
+        os.environ,
+        STORAGE_BACKEND='local',
+        LOCAL_STORAGE_ROOT=os.path.join(workdir, 'storage'),
+        LOCAL_STORAGE_LATENCY_MS=str(args.latency_ms),
+        LOCAL_STORAGE_BANDWIDTH_MBPS=str(args.bandwidth_mbps),
+        AZURE_STORAGE_CONTAINER_NAME=CONTAINER,
+        AZURE_FILE_SHARE_NAME=CONTAINER,
+        FILESHARE_INDEX_PATH=os.path.join(workdir, 'fileshare_index.sqlite3'),
+        SESSION_FILE_DIR=os.path.join(workdir, 'sessions'),
+        UPLOAD_MODE=args.upload_mode,
+    )
+    command = [
+        sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '--threads', str(args.threads),
+        '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'
+    ]
+    server = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {server.returncode}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/metrics', timeout=1).raise_for_status()
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError('gunicorn did not start within 30 seconds')
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def multipart(files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, data in files:
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'.encode()
+        )
+        body.write(data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+def scenarios(base, args):
+    # Each scenario is make_request(session) -> bytes transferred, as run_load expects
+    counter = itertools.count()
+    run_id = uuid.uuid4().hex[:8]
+    upload_data = os.urandom(args.upload_kb * 1024)
+    bulk_files = [(f'part-{i:03d}.bin', os.urandom(args.bulk_kb * 1024)) for i in range(args.bulk_files)]
+
+    def get(path):
+        def make_request(session):
+            response = session.get(base + path)
+            response.raise_for_status()
+            return len(response.content)
+        return make_request
+
+    def download_range(session):
+        response = session.get(base + '/download/large.bin', headers={'Range': 'bytes=1048576-2097151'})
+        if response.status_code != 206:
+            raise RuntimeError(f'expected 206, got {response.status_code}')
+        return len(response.content)
+
+    def upload(session):
+        body, content_type = multipart([(f'upload-{run_id}-{next(counter)}.bin', upload_data)])
+        response = session.post(
+            base + '/upload', data=body, headers={'Content-Type': content_type}, allow_redirects=False
+        )
+        # Success redirects to the index, failure back to the form
+        if response.status_code != 302 or response.headers['Location'].rstrip('/').endswith('/upload'):
+            raise RuntimeError(f'upload failed with status {response.status_code}')
+        return len(body)
+
+    def bulk(session):
+        body, content_type = multipart(bulk_files)
+        response = session.post(
+            base + f'/upload/bulk?prefix=bulk-{run_id}-{next(counter)}/',
+            data=body, headers={'Content-Type': content_type}
+        )
+        response.raise_for_status()
+        if response.json()['failed']:
+            raise RuntimeError('bulk upload reported failures')
+        return len(body)
+
+    return {
+        'list': get('/list'),
+        'list_prefix': get('/list?prefix=folder-3/&delimiter=/'),
+        'fileshare': get('/fileshare'),
+        'fileshare_search': get('/fileshare?q=report-00&min_size=100'),
+        'download': get('/download/large.bin'),
+        'download_range': download_range,
+        'upload': upload,
+        'upload_bulk': bulk,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{'scenario':<18}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'RSS MB':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<18}{result['requests_per_sec']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+            f"{result['p99_ms']:>10}{result['errors']:>8}{result['peak_rss_mb']:>9}"
+        )
+        previous = (baseline or {}).get(name)
+        if previous:
+            deltas = []
+            for metric in METRICS[:-1]:
+                if previous.get(metric):
+                    deltas.append(f"{metric} {(result[metric] - previous[metric]) / previous[metric]:+.1%}")
+            print(f"{'':<18}vs baseline: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', help='run only these scenarios (repeatable)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--latency-ms', type=float, default=20, help='simulated storage latency per call')
+    parser.add_argument(
+        '--bandwidth-mbps', type=float, default=800, help='simulated storage bandwidth per call, in Mbit/s'
+    )
+    parser.add_argument('--upload-mode', choices=('buffered', 'streaming'), default='buffered')
+    parser.add_argument('--blobs', type=int, default=2000)
+    parser.add_argument('--large-mb', type=int, default=16)
+    parser.add_argument('--share-dirs', type=int, default=20)
+    parser.add_argument('--share-files', type=int, default=50)
+    parser.add_argument('--upload-kb', type=int, default=1024)
+    parser.add_argument('--bulk-files', type=int, default=20)
+    parser.add_argument('--bulk-kb', type=int, default=64)
+    parser.add_argument('--output', help='JSON file for the results (default: benchmarks/results/<time>-<rev>.json)')
+    parser.add_argument('--compare', help='earlier results JSON to print deltas against')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='storage-bench-')
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    results = {}
+    try:
+        seed(os.path.join(workdir, 'storage'), args.blobs, args.large_mb, args.share_dirs, args.share_files)
+        server = start_server(args, workdir, port)
+        try:
+            # The first /fileshare request crawls the share, keep it out of the numbers
+            requests.get(base + '/fileshare').raise_for_status()
+            available = scenarios(base, args)
+            for name in args.scenario or available:
+                results[name] = run_load(available[name], args.concurrency, args.duration, pid=server.pid)
+                print(f'{name}: {results[name]["requests_per_sec"]} req/s', file=sys.stderr)
+        finally:
+            stop_server(server)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    finished = datetime.datetime.now(datetime.timezone.utc)
+    revision = git_revision()
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f"{finished:%Y%m%dT%H%M%SZ}-{revision or 'unknown'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'revision': revision,
+            'finished_at': finished.isoformat(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'config': vars(args),
+            'results': results,
+        }, f, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
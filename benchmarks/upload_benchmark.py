@@ -0,0 +1,123 @@
+"""Compare the buffered and streaming /upload paths against a local blob stand-in.
+
+The stand-in simulates one HTTP connection per call with a fixed latency and
+per-connection bandwidth, so parallel stage_block calls are what lets the
+streaming path go faster than a single upload_blob().
+
+    python benchmarks/upload_benchmark.py --size-mb 256 --chunk-mb 4 --concurrency 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from werkzeug.formparser import parse_form_data
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_storage import mbps_to_bytes  # noqa: E402
+from streaming_upload import stream_upload  # noqa: E402
+
+BOUNDARY = 'benchmarkboundary'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+SDK_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class FakeBlobClient:
+    def __init__(self, latency, bandwidth):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.received = 0
+
+    def _transfer(self, nbytes):
+        self.received += nbytes
+        time.sleep(self.latency + nbytes / self.bandwidth)
+
+    def upload_blob(self, data, **kwargs):
+        # The SDK default (max_concurrency=1) sends the stream block by block, serially
+        while True:
+            chunk = data.read(SDK_CHUNK_SIZE)
+            if not chunk:
+                break
+            self._transfer(len(chunk))
+        self._transfer(0)
+
+    def stage_block(self, block_id, data, length=None, **kwargs):
+        self._transfer(len(data))
+
+    def commit_block_list(self, block_list, **kwargs):
+        self._transfer(0)
+
+
+def write_body(path, size):
+    head = (
+        f'--{BOUNDARY}\r\n'
+        'Content-Disposition: form-data; name="file"; filename="bench.bin"\r\n'
+        'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode()
+    tail = f'\r\n--{BOUNDARY}--\r\n'.encode()
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        f.write(head)
+        remaining = size
+        while remaining:
+            n = min(remaining, len(block))
+            f.write(block[:n])
+            remaining -= n
+        f.write(tail)
+    return os.path.getsize(path)
+
+
+def run_buffered(path, length, client, args):
+    with open(path, 'rb') as body:
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'CONTENT_TYPE': CONTENT_TYPE,
+            'CONTENT_LENGTH': str(length),
+            'wsgi.input': body,
+        }
+        _, _, files = parse_form_data(environ)
+        client.upload_blob(files['file'])
+
+
+def run_streaming(path, length, client, args):
+    with open(path, 'rb') as body:
+        stream_upload(
+            body, CONTENT_TYPE, lambda name: client,
+            chunk_size=args.chunk_mb * 1024 * 1024, concurrency=args.concurrency
+        )
+
+
+def measure(name, runner, path, length, args):
+    client = FakeBlobClient(args.latency_ms / 1000, mbps_to_bytes(args.bandwidth_mbps))
+    tracemalloc.start()
+    start = time.perf_counter()
+    runner(path, length, client, args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    mb = client.received / (1024 * 1024)
+    print(f'{name:<10} {elapsed:8.2f}s {mb / elapsed:10.1f} MB/s {peak / (1024 * 1024):10.1f} MB peak')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=128)
+    parser.add_argument('--chunk-mb', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--bandwidth-mbps', type=float, default=400, help='per connection, in Mbit/s')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'body')
+        length = write_body(path, args.size_mb * 1024 * 1024)
+        print(f'{args.size_mb} MB upload, {args.chunk_mb} MB chunks, concurrency {args.concurrency}')
+        measure('buffered', run_buffered, path, length, args)
+        measure('streaming', run_streaming, path, length, args)
+
+
+if __name__ == '__main__':
+    main()
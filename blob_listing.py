@@ -0,0 +1,138 @@
+"""Paginated, cached blob listings for the /list page.
+
+Pages are fetched lazily: a ListingPage pulls items from the Azure page
+iterator while the template is being streamed, and only lands in the
+cache once the whole page has been read.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from azure.storage.blob import BlobProperties
+
+
+class ListingCache:
+    """Thread-safe TTL + LRU cache of listing pages keyed by (prefix, delimiter, marker, page_size, scope)."""
+
+    def __init__(self, maxsize=256, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, blob_name):
+        # Drop every page whose prefix would include blob_name
+        with self._lock:
+            for key in [key for key in self._entries if blob_name.startswith(key[0])]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ListingPage:
+    """One page of a listing, iterable exactly like a list of entries.
+
+    Entries are dicts with name, size, last_modified and is_prefix.
+    ``continuation_token`` and ``error`` are only meaningful after iteration.
+    """
+
+    def __init__(self, items=None, continuation_token=None, source=None, on_complete=None):
+        self.items = items
+        self.continuation_token = continuation_token
+        self.error = None
+        self._source = source
+        self._on_complete = on_complete
+
+    def __iter__(self):
+        if self.items is not None:
+            yield from self.items
+            return
+
+        items = []
+        try:
+            page = next(self._source)
+            for item in page:
+                entry = _entry(item)
+                items.append(entry)
+                yield entry
+        except StopIteration:
+            pass
+        except Exception as e:
+            self.error = f"Error listing files: {e}"
+            return
+        self.items = items
+        self.continuation_token = self._source.continuation_token
+        self._source = None
+        if self._on_complete is not None:
+            self._on_complete(self)
+
+
+def _entry(item):
+    # walk_blobs() pages mix BlobProperties with (sync or aio) BlobPrefix items
+    if isinstance(item, BlobProperties):
+        return {'name': item.name, 'size': item.size, 'last_modified': item.last_modified, 'is_prefix': False}
+    return {'name': item.name, 'size': None, 'last_modified': None, 'is_prefix': True}
+
+
+def list_blob_page(container_client, cache, prefix='', delimiter='', marker=None, page_size=500, scope=None):
+    # scope keeps pages listed with different credentials apart
+    key = (prefix, delimiter, marker, page_size, scope)
+    cached = cache.get(key)
+    if cached is not None:
+        return ListingPage(cached.items, cached.continuation_token)
+
+    if delimiter:
+        blobs = container_client.walk_blobs(
+            name_starts_with=prefix or None, delimiter=delimiter, results_per_page=page_size
+        )
+    else:
+        blobs = container_client.list_blobs(name_starts_with=prefix or None, results_per_page=page_size)
+    pages = blobs.by_page(continuation_token=marker)
+    return ListingPage(source=pages, on_complete=lambda page: cache.set(key, page))
+
+
+async def list_blob_page_async(container_client, cache, prefix='', delimiter='', marker=None, page_size=500, scope=None):
+    """list_blob_page() for an ``azure.storage.blob.aio`` ContainerClient.
+
+    The page is read completely before returning, errors propagate to the caller.
+    """
+    key = (prefix, delimiter, marker, page_size, scope)
+    cached = cache.get(key)
+    if cached is not None:
+        return ListingPage(cached.items, cached.continuation_token)
+
+    if delimiter:
+        blobs = container_client.walk_blobs(
+            name_starts_with=prefix or None, delimiter=delimiter, results_per_page=page_size
+        )
+    else:
+        blobs = container_client.list_blobs(name_starts_with=prefix or None, results_per_page=page_size)
+    pages = blobs.by_page(continuation_token=marker)
+    items = []
+    async for page in pages:
+        items = [_entry(item) async for item in page]
+        break
+    listing = ListingPage(items, pages.continuation_token)
+    cache.set(key, listing)
+    return listing
@@ -0,0 +1,170 @@
+"""Bulk ingestion of many files, or of zip/tar archives, in one request.
+
+Files are read from the multipart body one after another. Archive members
+are read straight out of the archive without being extracted to disk. Each
+file is hashed while it is buffered, and a bounded pool uploads it unless a
+blob with the same name and Content-MD5 already exists.
+"""
+import base64
+import hashlib
+import lzma
+import posixpath
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContentSettings
+
+from streaming_upload import READ_SIZE, FileParts
+
+# Raised for corrupt, truncated or misnamed archives (OSError covers gzip and bz2)
+ARCHIVE_ERRORS = (
+    zipfile.BadZipFile, zipfile.LargeZipFile, tarfile.TarError, zlib.error, lzma.LZMAError, EOFError, OSError
+)
+# Also raised for single zip members: encrypted ones (RuntimeError) and
+# unsupported compression methods such as deflate64 (NotImplementedError)
+MEMBER_ERRORS = ARCHIVE_ERRORS + (RuntimeError, NotImplementedError)
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_archive(filename):
+    name = filename.lower()
+    return name.endswith('.zip') or name.endswith(TAR_SUFFIXES)
+
+
+class UnreadableMember:
+    """Stands in for an archive member that could not be opened; reading it raises the error."""
+
+    def __init__(self, error):
+        self.error = error
+
+    def read(self, size=-1):
+        raise self.error
+
+
+def iter_archive(filename, fileobj, spool_size):
+    """Yield ``(name, fileobj)`` for every regular file in a zip or tar archive."""
+    if filename.lower().endswith('.zip'):
+        # The zip directory is at the end, so the archive (not its members)
+        # has to be spooled; it only spills to disk above spool_size
+        with tempfile.SpooledTemporaryFile(max_size=spool_size) as spool:
+            while True:
+                chunk = fileobj.read(READ_SIZE)
+                if not chunk:
+                    break
+                spool.write(chunk)
+            spool.seek(0)
+            with zipfile.ZipFile(spool) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    try:
+                        member = archive.open(info)
+                    except MEMBER_ERRORS as e:
+                        yield info.filename, UnreadableMember(e)
+                        continue
+                    with member:
+                        yield info.filename, member
+    else:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    yield member.name, archive.extractfile(member)
+
+
+def blob_name(name, prefix=''):
+    # Archive member paths must not escape the target prefix
+    name = posixpath.normpath(name.replace('\\', '/')).lstrip('/')
+    if name in ('', '.') or name == '..' or name.startswith('../'):
+        raise ValueError(f"Invalid file name: {name!r}")
+    return prefix + name
+
+
+def read_and_hash(fileobj, spool_size):
+    """Buffer fileobj (in memory up to spool_size) and return (data, md5 digest, size)."""
+    md5 = hashlib.md5()
+    size = 0
+    data = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    while True:
+        chunk = fileobj.read(READ_SIZE)
+        if not chunk:
+            break
+        md5.update(chunk)
+        size += len(chunk)
+        data.write(chunk)
+    data.seek(0)
+    return data, md5.digest(), size
+
+
+def put_blob(blob_client, data, md5, size, overwrite=False):
+    result = {'name': blob_client.blob_name, 'size': size, 'md5': base64.b64encode(md5).decode()}
+    try:
+        try:
+            props = blob_client.get_blob_properties()
+            existing_md5 = props.content_settings.content_md5
+            if existing_md5 is not None and bytes(existing_md5) == md5:
+                result['status'] = 'skipped'
+                return result
+        except ResourceNotFoundError:
+            pass
+        blob_client.upload_blob(
+            data, length=size, overwrite=overwrite, content_settings=ContentSettings(content_md5=bytearray(md5))
+        )
+        result['status'] = 'uploaded'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+    finally:
+        data.close()
+    return result
+
+
+def bulk_upload(stream, content_type, get_blob_client, concurrency=16, spool_size=8 * 1024 * 1024,
+                expand=True, overwrite=False, prefix=''):
+    """Upload every file part of a multipart body, expanding archives when ``expand`` is set.
+
+    At most ``concurrency`` files are uploading and as many more buffered at
+    any time. Returns one result dict per file, in request order.
+    """
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for filename, fileobj in FileParts(stream, content_type):
+            if not filename:
+                continue
+            archive = expand and is_archive(filename)
+            if archive:
+                entries = iter_archive(filename, fileobj, spool_size)
+            else:
+                entries = [(filename, fileobj)]
+
+            try:
+                for name, entry in entries:
+                    try:
+                        blob_client = get_blob_client(blob_name(name, prefix))
+                    except ValueError as e:
+                        results.append({'name': name, 'status': 'error', 'error': str(e)})
+                        continue
+                    try:
+                        data, md5, size = read_and_hash(entry, spool_size)
+                    except (MEMBER_ERRORS if archive else OSError) as e:
+                        # Only this file fails, e.g. an encrypted zip member or a full spool disk
+                        error = f"Unreadable archive member: {e}" if archive else str(e)
+                        results.append({'name': name, 'status': 'error', 'error': error})
+                        continue
+                    slots.acquire()
+                    future = executor.submit(put_blob, blob_client, data, md5, size, overwrite)
+                    future.add_done_callback(lambda _: slots.release())
+                    results.append(future)
+            except ARCHIVE_ERRORS as e:
+                if not archive:
+                    raise
+                # A corrupt archive only fails its own part, FileParts skips
+                # whatever is left of it
+                results.append({'name': filename, 'status': 'error', 'error': f"Invalid archive: {e}"})
+
+    return [result if isinstance(result, dict) else result.result() for result in results]
@@ -0,0 +1,179 @@
+"""Lazily built, per-process Azure clients.
+
+Nothing here touches the network at import time: each client is created on
+first use (or by preload() from gunicorn's post_fork hook), the blob and
+share clients share one pooled requests.Session, and managed identity
+tokens are reused until shortly before they expire. With ``local_storage``
+set, the storage clients are local stand-ins instead (see local_storage.py).
+"""
+import threading
+import time
+
+import msal
+from requests import Session
+from requests.adapters import HTTPAdapter
+from azure.core.credentials import AccessToken
+from azure.core.exceptions import ClientAuthenticationError
+from azure.core.pipeline.transport import RequestsTransport
+from azure.identity import ManagedIdentityCredential
+from azure.storage.blob import BlobServiceClient
+from azure.storage.fileshare import ShareClient
+
+from metrics import StorageMetricsPolicy, metrics
+
+STORAGE_SCOPE = 'https://storage.azure.com/.default'
+
+
+class CachingCredential:
+    """Wrap a TokenCredential and hand out its tokens until ``refresh_margin`` seconds before expiry."""
+
+    def __init__(self, credential, refresh_margin=300):
+        self._credential = credential
+        self._refresh_margin = refresh_margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, *scopes, **kwargs):
+        key = (scopes, kwargs.get('claims'), kwargs.get('tenant_id'))
+        token = self._tokens.get(key)
+        if token is not None and token.expires_on - self._refresh_margin > time.time():
+            return token
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is None or token.expires_on - self._refresh_margin <= time.time():
+                with metrics.span('managed_identity', 'get_token'):
+                    token = self._credential.get_token(*scopes, **kwargs)
+                self._tokens[key] = token
+            return token
+
+    def close(self):
+        self._credential.close()
+
+
+class UserTokenCredential:
+    """TokenCredential for a signed-in user, served from their MSAL token cache via acquire_token_silent."""
+
+    def __init__(self, msal_app, account):
+        self._msal_app = msal_app
+        self._account = account
+
+    def get_token(self, *scopes, **kwargs):
+        with metrics.span('msal', 'acquire_token_silent'):
+            result = self._msal_app.acquire_token_silent(list(scopes), account=self._account)
+        if not result or 'access_token' not in result:
+            raise ClientAuthenticationError('Login required')
+        return AccessToken(result['access_token'], int(time.time()) + int(result['expires_in']))
+
+    def close(self):
+        pass
+
+
+class ClientRegistry:
+    """Builds msal/credential/blob/share clients on first access and keeps them for the process."""
+
+    def __init__(self, blob_account_url, file_account_url, share_name, client_id, client_secret,
+                 authority, pool_size=32, download_chunk_size=4 * 1024 * 1024, local_storage=None):
+        self.blob_account_url = blob_account_url
+        self.file_account_url = file_account_url
+        self.share_name = share_name
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.authority = authority
+        self.pool_size = pool_size
+        self.download_chunk_size = download_chunk_size
+        self.local_storage = local_storage
+        self._lock = threading.RLock()
+        self._instances = {}
+        # Authority discovery responses, shared by every per-user msal app
+        self._msal_http_cache = {}
+
+    def _get(self, name, factory):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = self._instances[name] = factory()
+        return instance
+
+    @property
+    def msal_client(self):
+        # Construction runs authority discovery, so only pay for it on first login
+        return self._get('msal_client', lambda: self.msal_app())
+
+    def msal_app(self, token_cache=None):
+        # Apps for a user's own token cache reuse the discovery results in http_cache
+        with metrics.span('msal', 'create_app'):
+            return msal.ConfidentialClientApplication(
+                self.client_id, authority=self.authority, client_credential=self.client_secret,
+                token_cache=token_cache, http_cache=self._msal_http_cache
+            )
+
+    @property
+    def credential(self):
+        return self._get('credential', lambda: CachingCredential(ManagedIdentityCredential()))
+
+    @property
+    def http_session(self):
+        def build():
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            return session
+        return self._get('http_session', build)
+
+    def _transport(self):
+        return RequestsTransport(session=self.http_session, session_owner=False)
+
+    @property
+    def blob_service_client(self):
+        if self.local_storage is not None:
+            return self._get('blob_service_client', self.local_storage.blob_service_client)
+        return self._get('blob_service_client', lambda: BlobServiceClient(
+            self.blob_account_url, credential=self.credential, transport=self._transport(),
+            per_call_policies=[StorageMetricsPolicy(metrics, 'blob')],
+            max_single_get_size=self.download_chunk_size, max_chunk_get_size=self.download_chunk_size
+        ))
+
+    def user_blob_service_client(self, credential):
+        # Per-request client: the bearer token policy caches tokens, so it must not be shared between users
+        if self.local_storage is not None:
+            return self.local_storage.blob_service_client()
+        return BlobServiceClient(
+            self.blob_account_url, credential=credential, transport=self._transport(),
+            per_call_policies=[StorageMetricsPolicy(metrics, 'blob')],
+            max_single_get_size=self.download_chunk_size, max_chunk_get_size=self.download_chunk_size
+        )
+
+    @property
+    def share_client(self):
+        if self.local_storage is not None:
+            return self._get('share_client', self.local_storage.share_client)
+        return self._get('share_client', lambda: ShareClient(
+            self.file_account_url, share_name=self.share_name, credential=self.credential,
+            token_intent='backup', transport=self._transport(),
+            per_call_policies=[StorageMetricsPolicy(metrics, 'file')]
+        ))
+
+    def preload(self, logger=None):
+        """Build every client and fetch a storage token, e.g. from gunicorn's post_fork hook."""
+        started = time.perf_counter()
+        try:
+            self.blob_service_client
+            self.share_client
+            if self.local_storage is None:
+                self.credential.get_token(STORAGE_SCOPE)
+                self.msal_client
+        except Exception:
+            if logger is not None:
+                logger.exception('Preloading Azure clients failed')
+            return
+        if logger is not None:
+            logger.info('Preloaded Azure clients in %.0f ms', (time.perf_counter() - started) * 1000)
+
+    def reset(self):
+        # Forget clients inherited over a fork (gunicorn --preload) without
+        # closing sockets the parent may still be using
+        with self._lock:
+            self._instances.clear()
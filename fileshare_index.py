@@ -0,0 +1,249 @@
+"""Local SQLite index of an Azure File Share.
+
+The crawler lists directories concurrently (on a bounded thread pool, or
+as asyncio tasks for the aio clients) and then writes the results in one
+transaction. Each directory's listing is fingerprinted, and rows are only
+rewritten for directories whose fingerprint changed since the previous crawl.
+
+Every worker process opens the same database, so a crawl first takes a
+lease row in ``meta``; only one process crawls at a time, and a lease left
+behind by a crashed worker expires after ``lease_seconds``.
+"""
+import asyncio
+import hashlib
+import posixpath
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    crawled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_directory INTEGER NOT NULL,
+    size INTEGER,
+    etag TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+CREATE INDEX IF NOT EXISTS entries_size ON entries (size);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _fingerprint(entries):
+    digest = hashlib.sha1()
+    for entry in sorted(entries, key=lambda e: e['name']):
+        digest.update(f"{entry['name']}\0{entry['is_directory']}\0{entry['size']}\0{entry['etag']}\n".encode())
+    return digest.hexdigest()
+
+
+def _entry(item):
+    return {
+        'name': item.name,
+        'is_directory': bool(item.is_directory),
+        'size': None if item.is_directory else getattr(item, 'size', None),
+        'etag': getattr(item, 'etag', None),
+    }
+
+
+def _list_directory(share_client, path):
+    items = share_client.list_directories_and_files(directory_name=path or None, include=['timestamps', 'Etag'])
+    return [_entry(item) for item in items]
+
+
+async def _list_directory_async(share_client, path):
+    items = share_client.list_directories_and_files(directory_name=path or None, include=['timestamps', 'Etag'])
+    return [_entry(item) async for item in items]
+
+
+def _subdirectories(path, entries):
+    return [posixpath.join(path, entry['name']) for entry in entries if entry['is_directory']]
+
+
+class FileShareIndex:
+    def __init__(self, db_path, lease_seconds=900):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self._crawl_lock = threading.Lock()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @property
+    def crawling(self):
+        return self._crawl_lock.locked() or self._lease_expiry() is not None
+
+    def _lease_expiry(self, db=None):
+        if db is None:
+            with self._connect() as db:
+                return self._lease_expiry(db)
+        row = db.execute("SELECT value FROM meta WHERE key = 'crawl_lease'").fetchone()
+        if row:
+            expires = float(row[0].split()[1])
+            if expires > time.time():
+                return expires
+        return None
+
+    def _acquire_lease(self):
+        """Claim the crawl for this process; returns a token for _release_lease(), or None if taken."""
+        token = uuid.uuid4().hex
+        with self._connect() as db:
+            # Take the write lock up front so two workers cannot both see the lease free
+            db.execute('BEGIN IMMEDIATE')
+            if self._lease_expiry(db) is not None:
+                return None
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('crawl_lease', ?)",
+                (f'{token} {time.time() + self.lease_seconds}',)
+            )
+        return token
+
+    def _release_lease(self, token):
+        with self._connect() as db:
+            db.execute("DELETE FROM meta WHERE key = 'crawl_lease' AND value LIKE ?", (f'{token} %',))
+
+    def wait_for_crawl(self, timeout=60, interval=0.5):
+        """Block until no crawl holds the lease (in any worker), or ``timeout`` seconds pass."""
+        deadline = time.time() + timeout
+        while self.crawling and time.time() < deadline:
+            time.sleep(interval)
+
+    def last_crawl(self):
+        with self._connect() as db:
+            row = db.execute("SELECT value FROM meta WHERE key = 'last_crawl'").fetchone()
+        return float(row[0]) if row else None
+
+    def crawl(self, share_client, concurrency=8):
+        """Walk the whole share, returning the number of directories whose listing changed.
+
+        Returns None without doing anything if a crawl is already running,
+        in this process or another one sharing the database.
+        """
+        if not self._crawl_lock.acquire(blocking=False):
+            return None
+        token = None
+        try:
+            token = self._acquire_lease()
+            if token is None:
+                return None
+            started = time.time()
+            listings = {}
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                pending = {executor.submit(_list_directory, share_client, ''): ''}
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = pending.pop(future)
+                        listings[path] = future.result()
+                        for child in _subdirectories(path, listings[path]):
+                            pending[executor.submit(_list_directory, share_client, child)] = child
+            return self._apply(listings, started)
+        finally:
+            if token is not None:
+                self._release_lease(token)
+            self._crawl_lock.release()
+
+    async def crawl_async(self, share_client, concurrency=8):
+        """crawl() for an ``azure.storage.fileshare.aio`` ShareClient, listing with asyncio tasks."""
+        if not self._crawl_lock.acquire(blocking=False):
+            return None
+        token = None
+        try:
+            token = await asyncio.to_thread(self._acquire_lease)
+            if token is None:
+                return None
+            started = time.time()
+            listings = {}
+            slots = asyncio.Semaphore(concurrency)
+
+            async def walk(path):
+                async with slots:
+                    listings[path] = await _list_directory_async(share_client, path)
+                await asyncio.gather(*(walk(child) for child in _subdirectories(path, listings[path])))
+
+            await walk('')
+            return await asyncio.to_thread(self._apply, listings, started)
+        finally:
+            if token is not None:
+                await asyncio.to_thread(self._release_lease, token)
+            self._crawl_lock.release()
+
+    def _apply(self, listings, started):
+        changed = 0
+        with self._connect() as db:
+            known = dict(db.execute('SELECT path, fingerprint FROM directories'))
+            for path, entries in listings.items():
+                fingerprint = _fingerprint(entries)
+                if known.get(path) != fingerprint:
+                    self._write_directory(db, path, entries, fingerprint, started)
+                    changed += 1
+
+            # Directories that disappeared from the share
+            for path in set(known) - set(listings):
+                db.execute('DELETE FROM directories WHERE path = ?', (path,))
+                db.execute('DELETE FROM entries WHERE parent = ?', (path,))
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_crawl', ?)", (str(started),)
+            )
+        return changed
+
+    def _write_directory(self, db, path, entries, fingerprint, crawled_at):
+        db.execute('DELETE FROM entries WHERE parent = ?', (path,))
+        db.executemany(
+            'INSERT INTO entries (path, parent, name, is_directory, size, etag) VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (posixpath.join(path, e['name']), path, e['name'], int(e['is_directory']), e['size'], e['etag'])
+                for e in entries
+            ]
+        )
+        db.execute(
+            'INSERT OR REPLACE INTO directories (path, fingerprint, crawled_at) VALUES (?, ?, ?)',
+            (path, fingerprint, crawled_at)
+        )
+
+    def browse(self, path=''):
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            return db.execute(
+                'SELECT * FROM entries WHERE parent = ? ORDER BY is_directory DESC, name', (path,)
+            ).fetchall()
+
+    def search(self, name=None, min_size=None, max_size=None, limit=500):
+        clauses, params = [], []
+        if name:
+            escaped = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            params.append(f'%{escaped}%')
+        if min_size is not None:
+            clauses.append('size >= ?')
+            params.append(min_size)
+        if max_size is not None:
+            clauses.append('size <= ?')
+            params.append(max_size)
+        where = ' AND '.join(clauses) or '1'
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            return db.execute(
+                f'SELECT * FROM entries WHERE {where} ORDER BY path LIMIT ?', (*params, limit)
+            ).fetchall()
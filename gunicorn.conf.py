@@ -0,0 +1,13 @@
+# Picked up automatically by gunicorn when started from this directory
+import os
+import threading
+
+
+def post_fork(server, worker):
+    # Build the Azure clients and fetch a storage token in the background, so
+    # a freshly forked worker's first request doesn't pay for it
+    if os.getenv('PRELOAD_CLIENTS', '1') != '1':
+        return
+    from app import clients
+    clients.reset()
+    threading.Thread(target=clients.preload, args=(server.log,), name='preload-clients', daemon=True).start()
@@ -0,0 +1,317 @@
+"""Local stand-in for Azure Blob Storage and Azure Files.
+
+Implements the subset of the sync SDK clients the app uses, on top of a
+directory so every gunicorn worker sees the same data. Each call can be
+slowed down by a fixed latency plus a per-connection bandwidth limit, which
+makes load tests against it behave like a remote service. Bandwidth settings
+(LOCAL_STORAGE_BANDWIDTH_MBPS, --bandwidth-mbps) are in Mbit/s throughout,
+converted with mbps_to_bytes().
+
+    STORAGE_BACKEND=local LOCAL_STORAGE_ROOT=/tmp/storage gunicorn app:app
+"""
+import base64
+import datetime
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from urllib.parse import quote, unquote
+
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+from azure.storage.blob import BlobProperties, ContentSettings
+
+from metrics import metrics
+
+TRANSFER_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def mbps_to_bytes(mbps):
+    """Bandwidth in Mbit/s as bytes/second, the unit LocalStorage takes."""
+    return mbps * 1024 * 1024 / 8
+
+
+class LocalStorage:
+    def __init__(self, root, latency=0.0, bandwidth=0.0, download_chunk_size=TRANSFER_CHUNK_SIZE):
+        """``latency`` is seconds per call, ``bandwidth`` bytes/second per call (0 for unlimited)."""
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.download_chunk_size = download_chunk_size
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'blocks'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'share'), exist_ok=True)
+
+    def simulate(self, component, operation, nbytes=0):
+        delay = self.latency + (nbytes / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+        metrics.observe('storage_call_seconds', delay, component=component, operation=operation, status='local')
+
+    def blob_service_client(self):
+        return LocalBlobServiceClient(self)
+
+    def share_client(self):
+        return LocalShareClient(self)
+
+
+def _write_atomic(path, chunks):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+
+class LocalBlobServiceClient:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get_blob_client(self, container, blob):
+        return LocalBlobClient(self.storage, container, blob)
+
+    def get_container_client(self, container):
+        return LocalContainerClient(self.storage, container)
+
+
+class LocalBlobClient:
+    def __init__(self, storage, container, blob):
+        self.storage = storage
+        self.container_name = container
+        self.blob_name = blob
+        directory = os.path.join(storage.root, 'blobs', quote(container, safe=''))
+        self._path = os.path.join(directory, quote(blob, safe=''))
+        self._meta_path = self._path + '.meta'
+        self._blocks_dir = os.path.join(storage.root, 'blocks', quote(container, safe=''), quote(blob, safe=''))
+
+    def _write(self, chunks, content_settings=None, compute_md5=True):
+        md5 = hashlib.md5()
+
+        def hashed():
+            for chunk in chunks:
+                md5.update(chunk)
+                yield chunk
+
+        _write_atomic(self._path, hashed())
+        settings = content_settings or ContentSettings()
+        content_md5 = settings.content_md5
+        if content_md5 is None and compute_md5:
+            content_md5 = md5.digest()
+        meta = {
+            'content_type': settings.content_type or 'application/octet-stream',
+            'content_md5': base64.b64encode(bytes(content_md5)).decode() if content_md5 is not None else None,
+        }
+        _write_atomic(self._meta_path, [json.dumps(meta).encode()])
+
+    def upload_blob(self, data, length=None, overwrite=False, content_settings=None, **kwargs):
+        if not overwrite and os.path.exists(self._path):
+            raise ResourceExistsError('The specified blob already exists.')
+        if isinstance(data, (bytes, bytearray)):
+            data = io.BytesIO(data)
+
+        def chunks():
+            # Like the SDK without max_concurrency: one block after another
+            while True:
+                chunk = data.read(TRANSFER_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.storage.simulate('blob', 'PUT', len(chunk))
+                yield chunk
+
+        self._write(chunks(), content_settings)
+        self.storage.simulate('blob', 'PUT')
+
+    def stage_block(self, block_id, data, length=None, **kwargs):
+        self.storage.simulate('blob', 'PUT block', len(data))
+        _write_atomic(os.path.join(self._blocks_dir, quote(block_id, safe='')), [bytes(data)])
+
+    def commit_block_list(self, block_list, content_settings=None, etag=None, match_condition=None, **kwargs):
+        self.storage.simulate('blob', 'PUT blocklist')
+        if match_condition == MatchConditions.IfMissing and os.path.exists(self._path):
+            raise ResourceExistsError('The specified blob already exists.')
+
+        def chunks():
+            for block_id in block_list:
+                with open(os.path.join(self._blocks_dir, quote(block_id, safe='')), 'rb') as f:
+                    yield f.read()
+
+        try:
+            self._write(chunks(), content_settings, compute_md5=False)
+        except FileNotFoundError:
+            raise ResourceNotFoundError('The specified block list is invalid.')
+        for name in os.listdir(self._blocks_dir) if os.path.isdir(self._blocks_dir) else []:
+            os.remove(os.path.join(self._blocks_dir, name))
+
+    def _properties(self):
+        try:
+            stat = os.stat(self._path)
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise ResourceNotFoundError('The specified blob does not exist.')
+        props = BlobProperties()
+        props.name = self.blob_name
+        props.container = self.container_name
+        props.size = stat.st_size
+        props.etag = f'"0x{stat.st_mtime_ns:X}{stat.st_size:X}"'
+        props.last_modified = datetime.datetime.fromtimestamp(int(stat.st_mtime), tz=datetime.timezone.utc)
+        props.content_settings = ContentSettings(
+            content_type=meta['content_type'],
+            content_md5=bytearray(base64.b64decode(meta['content_md5'])) if meta['content_md5'] else None
+        )
+        return props
+
+    def get_blob_properties(self, **kwargs):
+        self.storage.simulate('blob', 'HEAD')
+        return self._properties()
+
+    def download_blob(self, offset=None, length=None, etag=None, match_condition=None, **kwargs):
+        props = self._properties()
+        if match_condition == MatchConditions.IfNotModified and etag != props.etag:
+            raise ResourceModifiedError('The condition specified using HTTP conditional header(s) is not met.')
+        start = offset or 0
+        end = props.size if length is None else min(props.size, start + length)
+        return LocalDownloader(self.storage, self._path, start, end)
+
+
+class LocalDownloader:
+    def __init__(self, storage, path, start, end):
+        self._storage = storage
+        self._path = path
+        self._start = start
+        self._end = end
+
+    def chunks(self):
+        with open(self._path, 'rb') as f:
+            f.seek(self._start)
+            remaining = self._end - self._start
+            while remaining > 0:
+                chunk = f.read(min(remaining, self._storage.download_chunk_size))
+                if not chunk:
+                    break
+                self._storage.simulate('blob', 'GET', len(chunk))
+                remaining -= len(chunk)
+                yield chunk
+
+    def readall(self):
+        return b''.join(self.chunks())
+
+
+class LocalPaged:
+    """Stands in for ItemPaged: iterable over all items, or page by page via by_page()."""
+
+    def __init__(self, storage, items, page_size):
+        self._storage = storage
+        self._items = items
+        self._page_size = page_size or 5000
+
+    def __iter__(self):
+        for page in self.by_page():
+            yield from page
+
+    def by_page(self, continuation_token=None):
+        return LocalPages(self._storage, self._items, self._page_size, continuation_token)
+
+
+class LocalPages:
+    def __init__(self, storage, items, page_size, continuation_token):
+        self._storage = storage
+        self._items = items
+        self._page_size = page_size
+        self.continuation_token = continuation_token
+        self._started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._started and self.continuation_token is None:
+            raise StopIteration
+        self._started = True
+        start = 0
+        if self.continuation_token:
+            names = [item.name for item in self._items]
+            start = next((i for i, name in enumerate(names) if name > self.continuation_token), len(names))
+        page = self._items[start:start + self._page_size]
+        self._storage.simulate('blob', 'GET list')
+        more = start + self._page_size < len(self._items)
+        self.continuation_token = page[-1].name if page and more else None
+        return iter(page)
+
+
+class LocalContainerClient:
+    def __init__(self, storage, container):
+        self.storage = storage
+        self.container_name = container
+        self._directory = os.path.join(storage.root, 'blobs', quote(container, safe=''))
+
+    def _blobs(self, prefix):
+        try:
+            files = os.listdir(self._directory)
+        except FileNotFoundError:
+            return []
+        names = sorted(
+            unquote(name) for name in files if not name.endswith('.meta') and not name.startswith('.tmp-')
+        )
+        blobs = []
+        for name in names:
+            if prefix and not name.startswith(prefix):
+                continue
+            try:
+                blobs.append(LocalBlobClient(self.storage, self.container_name, name)._properties())
+            except ResourceNotFoundError:
+                continue
+        return blobs
+
+    def list_blobs(self, name_starts_with=None, include=None, results_per_page=None, **kwargs):
+        return LocalPaged(self.storage, self._blobs(name_starts_with), results_per_page)
+
+    def walk_blobs(self, name_starts_with=None, include=None, delimiter='/', results_per_page=None, **kwargs):
+        prefix = name_starts_with or ''
+        items = []
+        seen = set()
+        for blob in self._blobs(prefix):
+            rest = blob.name[len(prefix):]
+            if delimiter in rest:
+                virtual = prefix + rest.split(delimiter, 1)[0] + delimiter
+                if virtual not in seen:
+                    seen.add(virtual)
+                    items.append(SimpleNamespace(name=virtual, prefix=virtual))
+            else:
+                items.append(blob)
+        return LocalPaged(self.storage, items, results_per_page)
+
+
+class LocalShareClient:
+    """Azure Files stand-in backed by a real directory tree under ``root/share``."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.share_name = 'local'
+        self._directory = os.path.join(storage.root, 'share')
+
+    def list_directories_and_files(self, directory_name=None, name_starts_with=None, include=None, **kwargs):
+        self.storage.simulate('file', 'GET list')
+        path = os.path.join(self._directory, *(directory_name or '').split('/'))
+        try:
+            entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            raise ResourceNotFoundError('The specified parent path does not exist.')
+        items = []
+        for entry in entries:
+            if name_starts_with and not entry.name.startswith(name_starts_with):
+                continue
+            stat = entry.stat()
+            is_directory = entry.is_dir()
+            items.append(SimpleNamespace(
+                name=entry.name,
+                is_directory=is_directory,
+                size=None if is_directory else stat.st_size,
+                etag=f'"0x{stat.st_mtime_ns:X}{stat.st_size:X}"',
+            ))
+        return items
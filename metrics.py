@@ -0,0 +1,183 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Every thread records into its own shard, so the hot path takes no locks;
+shards are only merged when /metrics is scraped, and the shards of threads
+that have exited are folded into one retired total. Each worker process keeps
+its own numbers, add the worker pid as a label when scraping several.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from azure.core.pipeline.policies import SansIOHTTPPolicy
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._descriptions = {}
+        self._shards = []
+        self._retired = ({}, {})
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+
+    def describe(self, name, kind, help_text):
+        self._descriptions[name] = (kind, help_text)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._shards_lock:
+                # Short-lived pool threads would otherwise leave a shard behind each
+                self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_shards(self):
+        # Caller holds _shards_lock; a dead thread no longer writes to its shard
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge_into(self._retired, shard, len(self.buckets))
+        self._shards = live
+
+    def inc(self, name, value=1, **labels):
+        counters = self._shard()[0]
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        histograms = self._shard()[1]
+        key = (name, tuple(sorted(labels.items())))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+    @contextmanager
+    def span(self, component, operation):
+        # Time a call to an external service, e.g. span('msal', 'acquire_token_silent')
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            self.observe(
+                'dependency_call_seconds', time.perf_counter() - started,
+                component=component, operation=operation, outcome=outcome
+            )
+
+    def _merged(self):
+        merged = ({}, {})
+        with self._shards_lock:
+            self._retire_dead_shards()
+            _merge_into(merged, self._retired, len(self.buckets))
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            _merge_into(merged, shard, len(self.buckets))
+        return merged
+
+    def render(self):
+        counters, histograms = self._merged()
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                help_text = self._descriptions.get(name, (kind, ''))[1]
+                if help_text:
+                    lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f'{name}{_labels(labels)} {value}')
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, n in zip(self.buckets, buckets):
+                cumulative += n
+                lines.append(f'{name}_bucket{_labels(labels + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _merge_into(target, shard, nbuckets):
+    counters, histograms = target
+    shard_counters, shard_histograms = shard
+    for key, value in list(shard_counters.items()):
+        counters[key] = counters.get(key, 0) + value
+    for key, (buckets, total, count) in list(shard_histograms.items()):
+        merged = histograms.setdefault(key, [[0] * nbuckets, 0.0, 0])
+        for i, n in enumerate(buckets):
+            merged[0][i] += n
+        merged[1] += total
+        merged[2] += count
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class StorageMetricsPolicy(SansIOHTTPPolicy):
+    """Azure SDK pipeline policy timing every storage HTTP call, retries included.
+
+    Works for both the sync and the aio clients.
+    """
+
+    def __init__(self, metrics, component):
+        super().__init__()
+        self._metrics = metrics
+        self._component = component
+
+    def on_request(self, request):
+        request.context['metrics_started'] = time.perf_counter()
+
+    def on_response(self, request, response):
+        self._record(request, str(response.http_response.status_code))
+
+    def on_exception(self, request):
+        self._record(request, 'error')
+
+    def _record(self, request, status):
+        started = request.context.get('metrics_started')
+        if started is None:
+            return
+        http_request = request.http_request
+        comp = http_request.query.get('comp') if http_request.query else None
+        operation = f'{http_request.method} {comp}' if comp else http_request.method
+        self._metrics.observe(
+            'storage_call_seconds', time.perf_counter() - started,
+            component=self._component, operation=operation, status=status
+        )
+
+
+metrics = Metrics()
+metrics.describe('http_request_seconds', 'histogram', 'Flask request latency, including streamed bodies.')
+metrics.describe('template_render_seconds', 'histogram', 'Jinja template rendering time.')
+metrics.describe('storage_call_seconds', 'histogram', 'Azure Storage HTTP calls made by the SDK clients.')
+metrics.describe('dependency_call_seconds', 'histogram', 'Token acquisition and other external calls.')
+metrics.describe('upload_bytes_total', 'counter', 'Bytes uploaded to Blob Storage.')
+metrics.describe('download_bytes_total', 'counter', 'Bytes streamed to clients from Blob Storage.')
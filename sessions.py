@@ -0,0 +1,163 @@
+"""Server-side Flask sessions.
+
+The session cookie only carries a random opaque id; the session data lives
+in a SessionStore. Nothing is signed or re-serialized per request, and the
+store is only written when the session was actually modified.
+"""
+import os
+import re
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+serializer = TaggedJSONSerializer()
+
+
+class MemorySessionStore:
+    """LRU of session dicts in this process; only suitable for a single worker."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return serializer.loads(data)
+
+    def set(self, sid, data, lifetime):
+        with self._lock:
+            self._entries[sid] = (time.time() + lifetime, serializer.dumps(data))
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+
+class FileSystemSessionStore:
+    """One file per session in ``directory``, shared by every worker on the host."""
+
+    def __init__(self, directory, purge_every=1000):
+        self.directory = directory
+        self.purge_every = purge_every
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def get(self, sid):
+        try:
+            with open(self._path(sid), encoding='utf-8') as f:
+                expires, _, data = f.read().partition('\n')
+        except FileNotFoundError:
+            return None
+        if float(expires) < time.time():
+            self.delete(sid)
+            return None
+        return serializer.loads(data)
+
+    def set(self, sid, data, lifetime):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(f'{time.time() + lifetime}\n{serializer.dumps(data)}')
+        os.replace(tmp_path, self._path(sid))
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.purge()
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def purge(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not SESSION_ID_RE.match(name):
+                continue
+            try:
+                with open(self._path(name), encoding='utf-8') as f:
+                    expires = float(f.readline())
+            except (OSError, ValueError):
+                continue
+            if expires < now:
+                self.delete(name)
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID_RE.match(sid):
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session):
+        # Issue a new id for the same data, e.g. at login, so an id planted
+        # before authentication (session fixation) stops being valid
+        if not session.new:
+            self.store.delete(session.sid)
+        session.sid = secrets.token_urlsafe(32)
+        session.new = True
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified or session.new:
+            lifetime = app.permanent_session_lifetime.total_seconds()
+            self.store.set(session.sid, dict(session), lifetime)
+
+        if session.new or (session.permanent and app.config['SESSION_REFRESH_EACH_REQUEST']):
+            response.set_cookie(
+                name, session.sid, expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app)
+            )
@@ -0,0 +1,282 @@
+"""Streaming multipart uploads to Azure Blob Storage.
+
+The request body is parsed incrementally and the file part is cut into
+fixed-size blocks that are staged concurrently, so a worker never holds
+more than roughly chunk_size * (concurrency + 1) bytes of the upload.
+"""
+import asyncio
+import base64
+import collections
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core import MatchConditions
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import NEED_DATA, Data, Epilogue, File, MultipartDecoder
+
+READ_SIZE = 64 * 1024
+
+
+class MissingFileError(ValueError):
+    pass
+
+
+class MultipartFileParser:
+    """Feed raw body bytes in, get ('file', name) / ('data', bytes) / ('end', None) events out.
+
+    Only file parts whose field name matches ``field`` (any name if None) are
+    reported, everything else in the form is skipped.
+    """
+
+    def __init__(self, content_type, field='file'):
+        mimetype, options = parse_options_header(content_type or '')
+        boundary = options.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            raise MissingFileError('No file part')
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._field = field
+        self._in_file = False
+
+    def feed(self, chunk):
+        self._decoder.receive_data(chunk or None)
+        events = []
+        while True:
+            event = self._decoder.next_event()
+            if event is NEED_DATA or isinstance(event, Epilogue):
+                return events
+            if isinstance(event, File) and self._field in (None, event.name):
+                self._in_file = True
+                events.append(('file', event.filename))
+            elif isinstance(event, Data) and self._in_file:
+                if event.data:
+                    events.append(('data', event.data))
+                if not event.more_data:
+                    self._in_file = False
+                    events.append(('end', None))
+
+
+class _PartReader(io.RawIOBase):
+    def __init__(self, parts):
+        self._parts = parts
+        self._pending = b''
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending and not self._done:
+            kind, value = self._parts._next_event()
+            if kind == 'data':
+                self._pending = value
+            else:
+                self._done = True
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def drain(self):
+        while self.read(READ_SIZE):
+            pass
+
+
+class FileParts:
+    """Pull-style iteration over the file parts of a multipart body.
+
+    Yields ``(filename, fileobj)`` pairs; each fileobj reads its part straight
+    from ``stream`` and must be used before advancing to the next part.
+    """
+
+    def __init__(self, stream, content_type, field=None, read_size=READ_SIZE):
+        self._stream = stream
+        self._parser = MultipartFileParser(content_type, field)
+        self._read_size = read_size
+        self._events = collections.deque()
+        self._eof = False
+
+    def _next_event(self):
+        while not self._events:
+            if self._eof:
+                return ('eof', None)
+            chunk = self._stream.read(self._read_size)
+            self._eof = not chunk
+            self._events.extend(self._parser.feed(chunk))
+        return self._events.popleft()
+
+    def __iter__(self):
+        while True:
+            kind, value = self._next_event()
+            if kind == 'eof':
+                return
+            if kind == 'file':
+                reader = _PartReader(self)
+                yield value, io.BufferedReader(reader, READ_SIZE)
+                reader.drain()
+
+
+def block_id(index):
+    return base64.b64encode(f'{index:08d}'.encode()).decode()
+
+
+class BlockUploader:
+    """Stage blocks of ``chunk_size`` bytes on a bounded pool, then commit them."""
+
+    def __init__(self, blob_client, executor, chunk_size, concurrency):
+        self._blob_client = blob_client
+        self._executor = executor
+        self._chunk_size = chunk_size
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._buffer = bytearray()
+        self._block_ids = []
+        self._futures = []
+        self._error = None
+        self.size = 0
+
+    def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self._chunk_size:
+            chunk = bytes(self._buffer[:self._chunk_size])
+            del self._buffer[:self._chunk_size]
+            self._stage(chunk)
+
+    def _stage(self, chunk):
+        self._raise_failed()
+        # Blocks until one of the in-flight stage_block calls finishes
+        self._slots.acquire()
+        try:
+            block = block_id(len(self._block_ids))
+            future = self._executor.submit(self._blob_client.stage_block, block, chunk, length=len(chunk))
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._done)
+        self._block_ids.append(block)
+        self._futures.append(future)
+
+    def _done(self, future):
+        if self._error is None and future.exception() is not None:
+            self._error = future.exception()
+        self._slots.release()
+
+    def _raise_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def commit(self):
+        if self._buffer:
+            self._stage(bytes(self._buffer))
+            self._buffer.clear()
+        for future in self._futures:
+            future.result()
+        # Same semantics as upload_blob(): refuse to overwrite an existing blob
+        self._blob_client.commit_block_list(
+            self._block_ids, etag='*', match_condition=MatchConditions.IfMissing
+        )
+        return self.size
+
+
+def stream_upload(stream, content_type, get_blob_client, chunk_size, concurrency,
+                  field='file', read_size=READ_SIZE):
+    """Upload the ``field`` part of a multipart body read from ``stream``.
+
+    ``get_blob_client`` is called with the uploaded filename once it is known.
+    Returns ``(filename, size)``.
+    """
+    parser = MultipartFileParser(content_type, field)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        uploader = None
+        filename = None
+        while True:
+            chunk = stream.read(read_size)
+            for kind, value in parser.feed(chunk):
+                if kind == 'file':
+                    if not value:
+                        raise MissingFileError('No selected file')
+                    filename = value
+                    uploader = BlockUploader(get_blob_client(filename), executor, chunk_size, concurrency)
+                elif kind == 'data':
+                    uploader.write(value)
+                else:
+                    return filename, uploader.commit()
+            if not chunk:
+                raise MissingFileError('No file part')
+
+
+class AsyncBlockUploader:
+    """BlockUploader for the ``azure.storage.blob.aio`` clients, staging blocks as asyncio tasks."""
+
+    def __init__(self, blob_client, chunk_size, concurrency):
+        self._blob_client = blob_client
+        self._chunk_size = chunk_size
+        self._slots = asyncio.Semaphore(concurrency)
+        self._buffer = bytearray()
+        self._block_ids = []
+        self._tasks = []
+        self._error = None
+        self.size = 0
+
+    async def write(self, data):
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self._chunk_size:
+            chunk = bytes(self._buffer[:self._chunk_size])
+            del self._buffer[:self._chunk_size]
+            await self._stage(chunk)
+
+    async def _stage(self, chunk):
+        if self._error is not None:
+            raise self._error
+        await self._slots.acquire()
+        block = block_id(len(self._block_ids))
+        task = asyncio.ensure_future(self._blob_client.stage_block(block, chunk, length=len(chunk)))
+        task.add_done_callback(self._done)
+        self._block_ids.append(block)
+        self._tasks.append(task)
+
+    def _done(self, task):
+        if self._error is None and not task.cancelled() and task.exception() is not None:
+            self._error = task.exception()
+        self._slots.release()
+
+    async def commit(self):
+        if self._buffer:
+            await self._stage(bytes(self._buffer))
+            self._buffer.clear()
+        await asyncio.gather(*self._tasks)
+        await self._blob_client.commit_block_list(
+            self._block_ids, etag='*', match_condition=MatchConditions.IfMissing
+        )
+        return self.size
+
+    def abort(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+async def async_stream_upload(chunks, content_type, get_blob_client, chunk_size, concurrency, field='file'):
+    """Async counterpart of stream_upload(), reading the body from the async iterable ``chunks``."""
+    parser = MultipartFileParser(content_type, field)
+    uploader = None
+    filename = None
+    try:
+        async for chunk in chunks:
+            for kind, value in parser.feed(chunk):
+                if kind == 'file':
+                    if not value:
+                        raise MissingFileError('No selected file')
+                    filename = value
+                    uploader = AsyncBlockUploader(get_blob_client(filename), chunk_size, concurrency)
+                elif kind == 'data':
+                    await uploader.write(value)
+                else:
+                    return filename, await uploader.commit()
+            if not chunk:
+                break
+        raise MissingFileError('No file part')
+    except BaseException:
+        if uploader is not None:
+            uploader.abort()
+        raise